@@ -6,9 +6,40 @@ import json
 import time
 import math
 import threading
+import queue
 import os
 from typing import List, Dict, Optional, Tuple
 
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    from pyproj import Geod
+    _GEOD = Geod(ellps="WGS84")
+except ImportError:
+    _GEOD = None
+
+try:
+    import orjson
+
+    _dumps_bytes = orjson.dumps
+
+    def _dumps_line(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError
+    _loads = orjson.loads
+except ImportError:
+    def _dumps_bytes(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+    def _dumps_line(obj) -> bytes:
+        return (json.dumps(obj) + "\n").encode()
+    _loads = json.loads
+
 # --- Monkey patch for Python 3.10+ compatibility ---
 if not hasattr(collections, 'MutableMapping'):
     collections.MutableMapping = collections.abc.MutableMapping
@@ -16,6 +47,11 @@ if not hasattr(collections, 'MutableMapping'):
 from dronekit import connect, VehicleMode, LocationGlobalRelative, Command
 from pymavlink import mavutil
 
+# Flight modes used by the mission, built once instead of on every transition
+MODE_GUIDED = VehicleMode("GUIDED")
+MODE_RTL = VehicleMode("RTL")
+MODE_LAND = VehicleMode("LAND")
+
 # --- Global state variables ---
 vehicle = None
 mission_task = None
@@ -23,8 +59,21 @@ current_mission = None
 is_mission_active = False
 telemetry_active = False
 sitl_process = None
-# --- NEW: Thread lock for safe message sending ---
-print_lock = threading.Lock()
+# Outbound messages are queued here and written by a single writer thread.
+# Coalesced messages (telemetry) go to a one-slot deque so stale ones drop;
+# _LATEST in the queue tells the writer to emit whatever that slot holds.
+_outbox = queue.SimpleQueue()
+_latest_outbox = collections.deque(maxlen=1)
+_LATEST = object()
+# Set once a vehicle link is up; telemetry sleeps on it until then
+vehicle_connected = threading.Event()
+# Set by stop_mission; lets a mission still booting SITL or connecting bail out
+mission_cancel_requested = threading.Event()
+
+# Telemetry is sampled at TELEMETRY_SAMPLE_INTERVAL and flushed to the
+# backend TELEMETRY_BATCH_SIZE samples at a time (every 250 ms).
+TELEMETRY_SAMPLE_INTERVAL = 0.05
+TELEMETRY_BATCH_SIZE = 5
 
 class MissionState:
     def __init__(self):
@@ -40,6 +89,8 @@ class MissionState:
         self.start_time: float = 0
         self.distance_flown: float = 0
         self.area_covered: float = 0
+        # Meters per degree of longitude at the survey area's center latitude
+        self.m_per_deg_lon: float = 0
 
 # --- NEW: Start SITL instance ---
 def start_sitl():
@@ -47,7 +98,7 @@ def start_sitl():
     global sitl_process
     try:
         from dronekit_sitl import SITL
-        send_message("status", "Starting SITL simulator...")
+        send_prebuilt(STATUS_SITL_STARTING)
         
         # Start SITL on TCP port 5760
         sitl = SITL()
@@ -56,7 +107,7 @@ def start_sitl():
         sitl.launch(sitl_args, await_ready=True, restart=True)
         
         # Connect to the simulator
-        send_message("status", "SITL simulator started successfully")
+        send_prebuilt(STATUS_SITL_STARTED)
         return sitl
     except Exception as e:
         send_message("error", f"Failed to start SITL: {str(e)}")
@@ -64,150 +115,367 @@ def start_sitl():
 
 # --- NEW: Re-written send_message function for stdout ---
 def send_message(message_type: str, payload):
-    """Formats a message and prints it to stdout for the Node.js parent."""
+    """Formats a message and queues it for the stdout writer thread."""
     try:
-        message = {
-            "type": message_type,
-            "payload": payload,
-            "timestamp": time.time()
-        }
-        with print_lock:
-            # Use print with flush=True to ensure Node.js receives it immediately
-            print(json.dumps(message), flush=True)
+        line = _dumps_line({"type": message_type, "payload": payload})
     except Exception as e:
         # It's crucial to see errors if they happen here
         error_message = {"type": "error", "payload": f"Error in send_message: {e}"}
-        with print_lock:
-            print(json.dumps(error_message), flush=True)
+        line = (json.dumps(error_message) + "\n").encode()
+    _outbox.put(line)
+
+def _write_messages():
+    """Drain queued messages to stdout; this is the only thread that writes it."""
+    out = sys.stdout.buffer
+    while True:
+        item = _outbox.get()
+        if item is _LATEST:
+            try:
+                item = _latest_outbox.popleft()
+            except IndexError:
+                # Already written on behalf of an earlier marker
+                continue
+        elif isinstance(item, threading.Event):
+            # flush_messages() marker: everything queued before it is out
+            item.set()
+            continue
+        # One write per newline-terminated message, flushed so Node.js
+        # receives it immediately
+        out.write(item)
+        out.flush()
+
+def flush_messages(timeout: float = 1.0):
+    """Wait for the writer thread to drain the outbox, e.g. before exiting."""
+    done = threading.Event()
+    _outbox.put(done)
+    done.wait(timeout)
+
+def _prebuild_message(message_type: str, payload) -> bytes:
+    """Serialize a fixed message once so it can be queued as-is."""
+    return _dumps_line({"type": message_type, "payload": payload})
+
+def send_prebuilt(line: bytes, coalesce: bool = False):
+    """Queue an already-serialized, newline-terminated message line.
+
+    With ``coalesce`` the line replaces any unsent line queued the same
+    way, so a slow reader only ever gets the newest one.
+    """
+    if coalesce:
+        _latest_outbox.append(line)
+        line = _LATEST
+    _outbox.put(line)
+
+# Telemetry is formatted from fixed templates instead of the generic encoder.
+# Samples are only taken while armed, so "armed" is a literal. Mode names are
+# looked up in a known ArduCopter set so they never need JSON escaping.
+FT_PER_M = 1.0 / 0.3048
+_COPTER_MODES = {
+    name: name.encode() for name in (
+        "STABILIZE", "ACRO", "ALT_HOLD", "AUTO", "GUIDED", "LOITER", "RTL",
+        "CIRCLE", "POSITION", "LAND", "OF_LOITER", "DRIFT", "SPORT", "FLIP",
+        "AUTOTUNE", "POSHOLD", "BRAKE", "THROW", "AVOID_ADSB", "GUIDED_NOGPS",
+        "SMART_RTL", "FLOWHOLD", "FOLLOW", "ZIGZAG", "INITIALISING"
+    )
+}
+_TELEMETRY_SAMPLE_FMT = (
+    b'{"lat":%.7f,"lng":%.7f,"alt":%.2f,"alt_feet":%.2f,"heading":%.2f,'
+    b'"ground_speed":%.2f,"battery":%d,"mode":"%s","armed":true,"gps_fix":%d'
+)
+_MISSION_STATUS_FMT = (
+    b',"mission_status":{"active":true,"photos_taken":%d,'
+    b'"current_waypoint":%d,"distance_flown":%.2f}'
+)
+_TELEMETRY_BATCH_FMT = b'{"type":"telemetry_batch","payload":[%s],"timestamp":%.3f}\n'
+
+# Reused by the generic fallback in _encode_telemetry_sample; only the
+# telemetry thread touches them
+_TELEMETRY_BUF = {
+    "lat": 0.0, "lng": 0.0, "alt": 0.0, "alt_feet": 0.0, "heading": 0.0,
+    "ground_speed": 0.0, "battery": 100, "mode": "", "armed": True, "gps_fix": 0
+}
+_MISSION_STATUS_BUF = {"active": True, "photos_taken": 0, "current_waypoint": 0, "distance_flown": 0.0}
+
+def _finite_or_none(value):
+    """Map NaN/inf readings to None so they serialize as JSON null."""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def _encode_telemetry_sample(lat, lng, alt, heading, ground_speed, battery, mode, gps_fix, mission) -> bytes:
+    """Encode one armed telemetry sample as a JSON object.
+
+    Falls back to the generic encoder when a value does not fit the
+    template, e.g. a reading that is still None or non-finite, or an
+    unknown mode name.
+    """
+    try:
+        distance_flown = mission.distance_flown if mission is not None else 0.0
+        isfinite = math.isfinite
+        if not (isfinite(lat) and isfinite(lng) and isfinite(alt) and isfinite(heading)
+                and isfinite(ground_speed) and isfinite(distance_flown)):
+            # %f would emit bare nan/inf, which is not valid JSON
+            raise ValueError("non-finite telemetry value")
+        sample = _TELEMETRY_SAMPLE_FMT % (
+            lat, lng, alt, alt * FT_PER_M, heading, ground_speed,
+            battery, _COPTER_MODES[mode], gps_fix
+        )
+        if mission is not None:
+            sample += _MISSION_STATUS_FMT % (
+                mission.photos_taken, mission.current_waypoint, distance_flown
+            )
+        return sample + b"}"
+    except (TypeError, KeyError, ValueError, OverflowError):
+        # Overwrite the shared buffers in place; they are serialized to bytes
+        # right here, so nothing queued keeps a reference to them
+        buf = _TELEMETRY_BUF
+        lat, lng, alt = _finite_or_none(lat), _finite_or_none(lng), _finite_or_none(alt)
+        buf["lat"], buf["lng"], buf["alt"] = lat, lng, alt
+        buf["alt_feet"] = alt * FT_PER_M if alt is not None else None
+        buf["heading"], buf["ground_speed"] = _finite_or_none(heading), _finite_or_none(ground_speed)
+        buf["battery"], buf["mode"], buf["gps_fix"] = _finite_or_none(battery), str(mode), gps_fix
+        if mission is not None:
+            status = _MISSION_STATUS_BUF
+            status["photos_taken"] = mission.photos_taken
+            status["current_waypoint"] = mission.current_waypoint
+            status["distance_flown"] = _finite_or_none(mission.distance_flown)
+            buf["mission_status"] = status
+        else:
+            buf.pop("mission_status", None)
+        return _dumps_bytes(buf)
+
+def send_telemetry_batch(samples, ts: float):
+    """Queue encoded telemetry samples as one coalescing telemetry_batch message."""
+    send_prebuilt(_TELEMETRY_BATCH_FMT % (b",".join(samples), ts), coalesce=True)
+
+# Fixed status lines, serialized once at import
+STATUS_SITL_STARTING = _prebuild_message("status", "Starting SITL simulator...")
+STATUS_SITL_STARTED = _prebuild_message("status", "SITL simulator started successfully")
+STATUS_CONNECTING = _prebuild_message("status", "Attempting to connect to vehicle...")
+STATUS_CONNECTED = _prebuild_message("status", "Vehicle connected successfully!")
+STATUS_GENERATING_PATTERN = _prebuild_message("status", "Generating survey pattern...")
+STATUS_PREFLIGHT = _prebuild_message("status", "Pre-flight checks...")
+STATUS_ARMING = _prebuild_message("status", "Arming vehicle...")
+STATUS_STARTUP_CANCELLED = _prebuild_message("status", "Mission cancelled before takeoff")
+STATUS_TAKEOFF_CANCELLED = _prebuild_message("status", "Mission cancelled during takeoff")
+STATUS_TAKEOFF_COMPLETE = _prebuild_message("status", "Takeoff complete, starting survey...")
+STATUS_MISSION_COMPLETE = _prebuild_message("status", "Mission complete - returning to launch")
+STATUS_MISSION_CANCELLED = _prebuild_message("status", "Mission cancelled - returning to launch")
+STATUS_STOPPING = _prebuild_message("status", "Stopping mission...")
+STATUS_EMERGENCY_LAND = _prebuild_message("status", "Emergency landing initiated")
+STATUS_SHUTTING_DOWN = _prebuild_message("status", "Shutting down simulation...")
+STATUS_SERVER_STARTED = _prebuild_message("status", "Python simulation server started")
+STATUS_SHUTDOWN_SIGNAL = _prebuild_message("status", "Shutdown signal received.")
+STATUS_CLOSING_VEHICLE = _prebuild_message("status", "Closing vehicle connection.")
 
 def connect_to_drone():
     """Connects to the SITL drone and returns the vehicle object."""
     global vehicle
-    send_message("status", "Attempting to connect to vehicle...")
+    send_prebuilt(STATUS_CONNECTING)
     try:
         # Connect to the SITL instance
         vehicle = connect('tcp:127.0.0.1:5760', wait_ready=True, timeout=60)
         vehicle.parameters['WPNAV_SPEED'] = 1000  # cm/s
         vehicle.parameters['WPNAV_RADIUS'] = 200  # cm
-        send_message("status", "Vehicle connected successfully!")
+        vehicle_connected.set()
+        send_prebuilt(STATUS_CONNECTED)
         return vehicle
     except Exception as e:
         send_message("error", f"Error connecting to vehicle: {e}")
         return None
 
-def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate distance between two GPS coordinates in meters."""
-    R = 6371000
-    lat1_rad, lat2_rad = math.radians(lat1), math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lon = math.radians(lon2 - lon1)
-    a = (math.sin(delta_lat/2)**2 +
-         math.cos(lat1_rad) * math.cos(lat2_rad) *
-         math.sin(delta_lon/2)**2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
-
-def generate_survey_pattern(waypoints: List[Dict], altitude: float, enhanced_3d: bool = False) -> List[Dict]:
-    """Generate a lawn-mower survey pattern from polygon waypoints."""
+EARTH_RADIUS_M = 6371000
+METERS_PER_DEG = EARTH_RADIUS_M * math.pi / 180
+
+def fast_distance_m(lat1: float, lon1: float, lat2: float, lon2: float, m_per_deg_lon: float) -> float:
+    """Equirectangular distance in meters, accurate for short separations.
+
+    ``m_per_deg_lon`` is ``METERS_PER_DEG * cos(lat)`` for a reference
+    latitude near both points and is expected to be cached by the caller.
+    """
+    return math.hypot((lon2 - lon1) * m_per_deg_lon, (lat2 - lat1) * METERS_PER_DEG)
+
+def polygon_area_m2(vertices: Optional[np.ndarray]) -> float:
+    """Area in square meters enclosed by a closed ``[lng, lat]`` vertex array.
+
+    Geodesic on the WGS84 ellipsoid via pyproj in a single call; without
+    pyproj, a planar shoelace estimate in a local projection.
+    """
+    if vertices is None or len(vertices) < 4:
+        return 0.0
+    lngs, lats = vertices[:, 0], vertices[:, 1]
+    if _GEOD is not None:
+        # The sign of the area only encodes the winding direction
+        area, _ = _GEOD.polygon_area_perimeter(lngs, lats)
+        return abs(area)
+    # Shoelace over vertex offsets from the first vertex
+    x, y = lngs - lngs[0], lats - lats[0]
+    twice_area = float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+    m_per_deg_lon = METERS_PER_DEG * math.cos(math.radians(lats[0]))
+    return abs(twice_area) / 2 * m_per_deg_lon * METERS_PER_DEG
+
+def haversine_vec(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Element-wise haversine distance in meters between paired coordinate arrays."""
+    lat1_rad, lat2_rad = np.radians(lat1), np.radians(lat2)
+    delta_lat = lat2_rad - lat1_rad
+    delta_lon = np.radians(lon2 - lon1)
+    a = np.sin(delta_lat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(delta_lon / 2) ** 2
+    return EARTH_RADIUS_M * 2 * np.arcsin(np.sqrt(a))
+
+def route_length_m(lats: np.ndarray, lngs: np.ndarray) -> float:
+    """Length in meters of the path through the given points.
+
+    All segments are measured in one vectorized call: geodesic with
+    pyproj, or spherical haversine when pyproj is not installed.
+    """
+    if lats.size < 2:
+        return 0.0
+    if _GEOD is None:
+        return float(haversine_vec(lats[:-1], lngs[:-1], lats[1:], lngs[1:]).sum())
+    return float(_GEOD.line_length(lngs, lats))
+
+def _axis_steps(lo: float, hi: float, spacing: float) -> np.ndarray:
+    """Evenly spaced samples from lo that never step past hi.
+
+    Uses an integer count rather than a float-step arange, whose
+    ``hi + spacing`` stop can yield an extra sample beyond the bounds.
+    """
+    return lo + spacing * np.arange(int((hi - lo) / spacing) + 1)
+
+def _lawnmower_grid(min_a: float, max_a: float, min_b: float, max_b: float, spacing: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Build a boustrophedon grid as flat coordinate arrays.
+
+    Rows step along the first axis; every other row is reversed along the
+    second axis so consecutive points stay adjacent.
+    """
+    a_vec = _axis_steps(min_a, max_a, spacing)
+    b_vec = _axis_steps(min_b, max_b, spacing)
+    A, B = np.meshgrid(a_vec, b_vec, indexing='ij')
+    B[1::2] = B[1::2, ::-1]
+    return A.ravel(), B.ravel()
+
+if njit is not None:
+    @njit(cache=True)
+    def _lawnmower_grid_jit(min_a, max_a, min_b, max_b, spacing):
+        """Compiled _lawnmower_grid: fills preallocated arrays in one zig-zag pass."""
+        a_vec = min_a + spacing * np.arange(int((max_a - min_a) / spacing) + 1)
+        b_vec = min_b + spacing * np.arange(int((max_b - min_b) / spacing) + 1)
+        n_a, n_b = a_vec.size, b_vec.size
+        A = np.empty(n_a * n_b)
+        B = np.empty(n_a * n_b)
+        k = 0
+        for i in range(n_a):
+            for j in range(n_b):
+                A[k] = a_vec[i]
+                B[k] = b_vec[j] if i % 2 == 0 else b_vec[n_b - 1 - j]
+                k += 1
+        return A, B
+
+    _lawnmower_grid = _lawnmower_grid_jit
+
+def generate_survey_pattern(waypoints: List[Dict], altitude: float, enhanced_3d: bool = False) -> Tuple[Dict[str, np.ndarray], Optional[np.ndarray]]:
+    """Generate a lawn-mower survey pattern from polygon waypoints.
+
+    Returns the points as parallel arrays keyed ``lat``, ``lng``,
+    ``altitude`` and ``photo`` (a boolean mask of photo stops), together
+    with the closed ``[lng, lat]`` vertex array so callers can reuse it
+    (None when there are too few waypoints to form a polygon).
+    """
     if len(waypoints) < 3: 
         send_message("error", "Need at least 3 waypoints to generate survey pattern")
-        return waypoints
+        return {
+            'lat': np.array([wp['lat'] for wp in waypoints], dtype=float),
+            'lng': np.array([wp['lng'] for wp in waypoints], dtype=float),
+            'altitude': np.array([wp.get('altitude', altitude) for wp in waypoints], dtype=float),
+            'photo': np.zeros(len(waypoints), dtype=bool)
+        }, None
     
-    # Convert to Turf.js compatible format [lng, lat]
-    polygon_coords = [[wp['lng'], wp['lat']] for wp in waypoints]
-    polygon_coords.append(polygon_coords[0])  # Close the polygon
+    # Polygon vertices as [lng, lat], closed back onto the first vertex
+    vertices = np.array([(wp['lng'], wp['lat']) for wp in waypoints], dtype=float)
+    vertices = np.vstack([vertices, vertices[:1]])
+    min_lng, min_lat = vertices.min(axis=0)
+    max_lng, max_lat = vertices.max(axis=0)
+    grid_spacing = 0.0001  # Approximately 10 meters
     
     try:
-        import turf
-        # Create a polygon from the waypoints
-        polygon = turf.polygon([polygon_coords])
-        
-        # Calculate bounding box
-        bbox = turf.bbox(polygon)
-        min_lng, min_lat, max_lng, max_lat = bbox
-        
-        survey_points = []
-        grid_spacing = 0.0001  # Approximately 10 meters
-        current_lat, row = min_lat, 0
-        
-        while current_lat <= max_lat:
-            if row % 2 == 0:
-                current_lon = min_lng
-                while current_lon <= max_lng:
-                    point = turf.point([current_lon, current_lat])
-                    if turf.boolean_point_in_polygon(point, polygon):
-                        survey_points.append({'lat': current_lat, 'lng': current_lon, 'altitude': altitude, 'action': 'photo'})
-                    current_lon += grid_spacing
-            else:
-                current_lon = max_lng
-                while current_lon >= min_lng:
-                    point = turf.point([current_lon, current_lat])
-                    if turf.boolean_point_in_polygon(point, polygon):
-                        survey_points.append({'lat': current_lat, 'lng': current_lon, 'altitude': altitude, 'action': 'photo'})
-                    current_lon -= grid_spacing
-            current_lat += grid_spacing
-            row += 1
-            
-        if enhanced_3d:
-            # Add perpendicular grid for enhanced 3D
-            current_lon, col = min_lon, 0
-            while current_lon <= max_lon:
-                if col % 2 == 0:
-                    current_lat = min_lat
-                    while current_lat <= max_lat:
-                        point = turf.point([current_lon, current_lat])
-                        if turf.boolean_point_in_polygon(point, polygon):
-                            survey_points.append({'lat': current_lat, 'lng': current_lon, 'altitude': altitude + 10, 'action': 'photo'})
-                        current_lat += grid_spacing
-                else:
-                    current_lat = max_lat
-                    while current_lat >= min_lat:
-                        point = turf.point([current_lon, current_lat])
-                        if turf.boolean_point_in_polygon(point, polygon):
-                            survey_points.append({'lat': current_lat, 'lng': current_lon, 'altitude': altitude + 10, 'action': 'photo'})
-                        current_lat -= grid_spacing
-                current_lon += grid_spacing
-                col += 1
-                
-        send_message("status", f"Generated {len(survey_points)} survey points")
-        return survey_points
-        
-    except ImportError:
-        send_message("error", "Turf library not available, using simple grid pattern")
-        # Fallback to simple grid if turf is not available
-        lats, lons = [wp['lat'] for wp in waypoints], [wp['lng'] for wp in waypoints]
-        min_lat, max_lat = min(lats), max(lats)
-        min_lon, max_lon = min(lons), max(lons)
-        
-        survey_points = []
-        grid_spacing = 0.0001
-        current_lat, row = min_lat, 0
-        
-        while current_lat <= max_lat:
-            if row % 2 == 0:
-                for current_lon in [min_lon + i * grid_spacing for i in range(int((max_lon - min_lon) / grid_spacing) + 1)]:
-                    survey_points.append({'lat': current_lat, 'lng': current_lon, 'altitude': altitude, 'action': 'photo'})
-            else:
-                for current_lon in reversed([min_lon + i * grid_spacing for i in range(int((max_lon - min_lon) / grid_spacing) + 1)]):
-                    survey_points.append({'lat': current_lat, 'lng': current_lon, 'altitude': altitude, 'action': 'photo'})
-            current_lat += grid_spacing
-            row += 1
-            
-        if enhanced_3d:
-            perpendicular_points = []
-            current_lon, col = min_lon, 0
-            while current_lon <= max_lon:
-                if col % 2 == 0:
-                    for current_lat in [min_lat + i * grid_spacing for i in range(int((max_lat - min_lat) / grid_spacing) + 1)]:
-                        perpendicular_points.append({'lat': current_lat, 'lng': current_lon, 'altitude': altitude + 10, 'action': 'photo'})
-                else:
-                    for current_lat in reversed([min_lat + i * grid_spacing for i in range(int((max_lat - min_lat) / grid_spacing) + 1)]):
-                        perpendicular_points.append({'lat': current_lat, 'lng': current_lon, 'altitude': altitude + 10, 'action': 'photo'})
-                current_lon += grid_spacing
-                col += 1
-            survey_points.extend(perpendicular_points)
-            
-        return survey_points
+        import shapely
+        polygon = shapely.Polygon(vertices)
+        shapely.prepare(polygon)
+    except (ImportError, AttributeError):
+        # Shapely 1.x imports fine but lacks the 2.0 top-level API used here
+        send_message("error", "Shapely 2.0+ not available, using simple grid pattern")
+        # Fall back to the full bounding box
+        polygon = None
+    
+    lats, lngs = _lawnmower_grid(min_lat, max_lat, min_lng, max_lng, grid_spacing)
+    passes = [(lats, lngs, altitude)]
+    
+    if enhanced_3d:
+        # Add perpendicular grid for enhanced 3D by sweeping along the other axis
+        cross_lngs, cross_lats = _lawnmower_grid(min_lng, max_lng, min_lat, max_lat, grid_spacing)
+        passes.append((cross_lats, cross_lngs, altitude + 10))
+    
+    # Clip each pass to the polygon (edges included) in one call; masking keeps the sweep order
+    masks = [
+        None if polygon is None else shapely.intersects_xy(polygon, pass_lngs, pass_lats)
+        for pass_lats, pass_lngs, _ in passes
+    ]
+    counts = [
+        pass_lats.size if mask is None else int(np.count_nonzero(mask))
+        for (pass_lats, _, _), mask in zip(passes, masks)
+    ]
+    
+    # Size the output once and fill each pass's slice in place
+    total = sum(counts)
+    points = {
+        'lat': np.empty(total), 'lng': np.empty(total),
+        'altitude': np.empty(total), 'photo': np.ones(total, dtype=bool)
+    }
+    offset = 0
+    for (pass_lats, pass_lngs, pass_alt), mask, count in zip(passes, masks, counts):
+        end = offset + count
+        if mask is None:
+            points['lat'][offset:end] = pass_lats
+            points['lng'][offset:end] = pass_lngs
+        else:
+            np.compress(mask, pass_lats, out=points['lat'][offset:end])
+            np.compress(mask, pass_lngs, out=points['lng'][offset:end])
+        points['altitude'][offset:end] = pass_alt
+        offset = end
+    
+    send_message("status", f"Generated {total} survey points")
+    return points, vertices
+
+def wait_for_vehicle(attr_names: Tuple[str, ...], predicate, timeout: Optional[float] = None, poll: float = 0.5) -> bool:
+    """Block until predicate() holds, waking on DroneKit attribute updates.
+
+    Returns False if the timeout expires or the mission is stopped first.
+    ``poll`` bounds how long a stop request or an unreported change can go
+    unnoticed.
+    """
+    changed = threading.Event()
+
+    def on_change(_vehicle, _name, _value):
+        changed.set()
+
+    for name in attr_names:
+        vehicle.add_attribute_listener(name, on_change)
+    try:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not predicate():
+            if not is_mission_active:
+                return False
+            wait = poll
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(poll, remaining)
+            changed.wait(wait)
+            changed.clear()
+        return True
+    finally:
+        for name in attr_names:
+            vehicle.remove_attribute_listener(name, on_change)
 
 # --- MODIFICATION: execute_mission is now synchronous ---
 def execute_mission(mission_data: Dict):
@@ -216,9 +484,15 @@ def execute_mission(mission_data: Dict):
     if not vehicle:
         send_message("error", "Cannot start mission, vehicle not connected.")
         return
+    
+    is_mission_active = True
+    # A stop that raced the flag above is only visible through the event
+    if mission_cancel_requested.is_set():
+        is_mission_active = False
+        send_prebuilt(STATUS_STARTUP_CANCELLED)
+        return
         
     try:
-        is_mission_active = True
         current_mission = MissionState()
         current_mission.start_time = time.time()
         
@@ -228,246 +502,287 @@ def execute_mission(mission_data: Dict):
         current_mission.waypoints = waypoints
         current_mission.altitude = altitude
         
-        send_message("status", "Generating survey pattern...")
-        survey_points = generate_survey_pattern(waypoints, altitude, enhanced_3d)
+        send_prebuilt(STATUS_GENERATING_PATTERN)
+        survey_points, vertices = generate_survey_pattern(waypoints, altitude, enhanced_3d)
         
-        if not survey_points:
+        total_points = survey_points['lat'].size
+        if not total_points:
             send_message("error", "Failed to generate survey pattern")
             is_mission_active = False
             return
             
         # Calculate area covered
-        try:
-            import turf
-            polygon_coords = [[wp['lng'], wp['lat']] for wp in waypoints]
-            polygon_coords.append(polygon_coords[0])  # Close the polygon
-            polygon = turf.polygon([polygon_coords])
-            area_m2 = turf.area(polygon)
-            current_mission.area_covered = area_m2
-            acres = area_m2 / 4046.86
-        except ImportError:
-            # Estimate area if turf is not available
-            lats = [wp['lat'] for wp in waypoints]
-            lons = [wp['lng'] for wp in waypoints]
-            width = calculate_distance(min(lats), min(lons), min(lats), max(lons))
-            height = calculate_distance(min(lats), min(lons), max(lats), min(lons))
-            area_m2 = width * height
-            current_mission.area_covered = area_m2
-            acres = area_m2 / 4046.86
+        area_m2 = polygon_area_m2(vertices)
+        current_mission.area_covered = area_m2
+        acres = area_m2 / 4046.86
+        
+        # One flat-earth scale factor serves every short segment within the survey area
+        lats = survey_points['lat']
+        center_lat = (float(lats.min()) + float(lats.max())) / 2
+        current_mission.m_per_deg_lon = METERS_PER_DEG * math.cos(math.radians(center_lat))
+        
+        # Estimate flight time from the planned route
+        route_m = route_length_m(survey_points['lat'], survey_points['lng'])
+        photo_stops = int(np.count_nonzero(survey_points['photo']))
+        estimated_time = round(route_m / current_mission.flight_speed + photo_stops * 0.5)
         
         send_message("mission_info", {
-            "total_waypoints": len(survey_points),
-            "estimated_time": len(survey_points) * 3,
+            "total_waypoints": total_points,
+            "estimated_time": estimated_time,
+            "route_distance_m": route_m,
             "coverage_pattern": "enhanced_3d" if enhanced_3d else "standard_grid",
             "area_covered_m2": area_m2,
             "area_covered_acres": acres
         })
         
-        send_message("status", "Pre-flight checks...")
+        send_prebuilt(STATUS_PREFLIGHT)
 
         # Wait for vehicle to be armable
-        timeout, start_time = 30, time.time()
-        while not vehicle.is_armable and time.time() - start_time < timeout: 
-            time.sleep(1)
-            
-        if not vehicle.is_armable: 
+        armable = wait_for_vehicle(('mode', 'gps_0', 'ekf_ok'), lambda: vehicle.is_armable, timeout=30, poll=1)
+        
+        if not is_mission_active: 
+            return
+        if not armable: 
             raise Exception("Vehicle not armable after 30s timeout")
 
-        send_message("status", "Arming vehicle...")
-        vehicle.mode = VehicleMode("GUIDED")
+        send_prebuilt(STATUS_ARMING)
+        vehicle.mode = MODE_GUIDED
         vehicle.armed = True
         
-        while not vehicle.armed and is_mission_active: 
-            time.sleep(0.5)
-            
-        if not is_mission_active: 
+        if not wait_for_vehicle(('armed',), lambda: vehicle.armed): 
             return
 
         send_message("status", f"Taking off to {altitude:.0f}m...")
         vehicle.simple_takeoff(altitude)
         
-        while vehicle.location.global_relative_frame.alt < altitude * 0.95 and is_mission_active: 
-            time.sleep(0.5)
+        reached = wait_for_vehicle(
+            ('location.global_relative_frame',),
+            lambda: vehicle.location.global_relative_frame.alt >= altitude * 0.95
+        )
         
-        if not is_mission_active:
-            send_message("status", "Mission cancelled during takeoff")
-            vehicle.mode = VehicleMode("RTL")
+        if not reached:
+            send_prebuilt(STATUS_TAKEOFF_CANCELLED)
+            vehicle.mode = MODE_RTL
             return
         
-        send_message("status", "Takeoff complete, starting survey...")
-        previous_position = vehicle.location.global_relative_frame
+        send_prebuilt(STATUS_TAKEOFF_COMPLETE)
+        start = vehicle.location.global_relative_frame
+        prev_lat, prev_lon = start.lat, start.lon
         
-        for i, point in enumerate(survey_points):
-            if not is_mission_active: 
-                break
-                
-            send_message("status", f"Flying to survey point {i+1}/{len(survey_points)}")
-            send_message("waypoint_progress", {
-                "current": i + 1, 
-                "total": len(survey_points), 
-                "percentage": ((i + 1) / len(survey_points)) * 100
-            })
-            
-            target_location = LocationGlobalRelative(point['lat'], point['lng'], point.get('altitude', altitude))
-            vehicle.simple_goto(target_location, groundspeed=current_mission.flight_speed)
-            
-            # Calculate distance to this waypoint
-            while is_mission_active:
-                loc = vehicle.location.global_relative_frame
-                distance = calculate_distance(loc.lat, loc.lon, point['lat'], point['lng'])
-                
-                # Update distance flown
-                current_position = vehicle.location.global_relative_frame
-                segment_distance = calculate_distance(
-                    previous_position.lat, previous_position.lon,
-                    current_position.lat, current_position.lon
-                )
-                current_mission.distance_flown += segment_distance
-                previous_position = current_position
+        # simple_goto encodes the target immediately, so one location object is reused
+        target_location = LocationGlobalRelative(0.0, 0.0, 0.0)
+        # Materialize Python floats once rather than boxing a NumPy scalar per read
+        point_rows = zip(*(survey_points[key].tolist() for key in ('lat', 'lng', 'altitude', 'photo')))
+        
+        # One position listener serves the whole survey; it wakes the arrival check
+        position_updated = threading.Event()
+        
+        def on_position(_vehicle, _name, _value):
+            position_updated.set()
+        
+        vehicle.add_attribute_listener('location.global_relative_frame', on_position)
+        try:
+            for i, (target_lat, target_lng, target_alt, take_photo) in enumerate(point_rows):
+                if not is_mission_active: 
+                    break
+                    
+                target_location.lat, target_location.lon, target_location.alt = target_lat, target_lng, target_alt
+                vehicle.simple_goto(target_location, groundspeed=current_mission.flight_speed)
+                m_per_deg_lon = METERS_PER_DEG * math.cos(math.radians(target_lat))
                 
-                if distance < 2: 
+                # Re-check the distance to this waypoint on each position update
+                while is_mission_active:
+                    # Each access builds a new location object, so read it once per update
+                    loc = vehicle.location.global_relative_frame
+                    lat, lon = loc.lat, loc.lon
+                    distance = fast_distance_m(lat, lon, target_lat, target_lng, m_per_deg_lon)
+                    
+                    # Update distance flown
+                    segment_distance = fast_distance_m(
+                        prev_lat, prev_lon, lat, lon, current_mission.m_per_deg_lon
+                    )
+                    current_mission.distance_flown += segment_distance
+                    prev_lat, prev_lon = lat, lon
+                    
+                    if distance < 2: 
+                        break
+                    position_updated.wait(0.5)
+                    position_updated.clear()
+                    
+                if not is_mission_active: 
                     break
-                time.sleep(0.2)
                 
-            if not is_mission_active: 
-                break
-            
-            if point.get('action') == 'photo':
-                current_mission.photos_taken += 1
-                send_message("photo_taken", {
-                    "photo_number": current_mission.photos_taken, 
+                if take_photo:
+                    current_mission.photos_taken += 1
+                
+                # One message per waypoint carries both progress and photo details
+                send_message("waypoint_complete", {
+                    "index": i,
+                    "current": i + 1,
+                    "total": total_points,
+                    "percentage": ((i + 1) / total_points) * 100,
+                    "photo_taken": bool(take_photo),
+                    "photo_number": current_mission.photos_taken,
                     "location": {
-                        "lat": point['lat'], 
-                        "lng": point['lng'], 
-                        "altitude": point.get('altitude', altitude)
+                        "lat": target_lat, 
+                        "lng": target_lng, 
+                        "altitude": target_alt
                     }
                 })
-                time.sleep(0.5)
+                if take_photo:
+                    time.sleep(0.5)
+        finally:
+            vehicle.remove_attribute_listener('location.global_relative_frame', on_position)
         
         if is_mission_active:
             mission_duration = time.time() - current_mission.start_time
             send_message("mission_complete", {
                 "photos_taken": current_mission.photos_taken,
-                "waypoints_completed": len(survey_points),
+                "waypoints_completed": total_points,
                 "distance_flown": current_mission.distance_flown,
                 "area_covered": current_mission.area_covered,
                 "mission_duration": mission_duration
             })
-            send_message("status", "Mission complete - returning to launch")
+            send_prebuilt(STATUS_MISSION_COMPLETE)
         else:
-            send_message("status", "Mission cancelled - returning to launch")
+            send_prebuilt(STATUS_MISSION_CANCELLED)
         
-        vehicle.mode = VehicleMode("RTL")
-        while vehicle.armed and is_mission_active: 
-            time.sleep(1)
+        vehicle.mode = MODE_RTL
+        wait_for_vehicle(('armed',), lambda: not vehicle.armed, poll=1)
             
         send_message("simulation_end", "Landing complete")
         
     except Exception as e:
         send_message("error", f"Mission error: {str(e)}")
         if vehicle: 
-            vehicle.mode = VehicleMode("RTL")
+            vehicle.mode = MODE_RTL
     finally:
         is_mission_active = False
         current_mission = None
 
+def run_mission(mission_data: Dict):
+    """Bring up SITL and the vehicle link if needed, then fly the mission.
+
+    Runs on the mission thread so SITL boot and the vehicle handshake never
+    block the stdin command loop.
+    """
+    global sitl_process
+    # Start SITL if not already running
+    if not vehicle:
+        sitl_process = start_sitl()
+        if not sitl_process:
+            send_message("error", "Failed to start SITL simulator")
+            return
+        if mission_cancel_requested.is_set():
+            send_prebuilt(STATUS_STARTUP_CANCELLED)
+            return
+        
+        # Connect to drone
+        if not connect_to_drone():
+            send_message("error", "Failed to connect to drone")
+            return
+    
+    execute_mission(mission_data)
+
 # --- MODIFICATION: stream_telemetry is now synchronous ---
 def stream_telemetry():
     """Stream real-time telemetry data in a loop."""
     global telemetry_active
     telemetry_active = True
-    previous_position = None
+    prev_lat = prev_lon = None
+    samples = collections.deque(maxlen=TELEMETRY_BATCH_SIZE)
+    # Bind hot callables and constants to locals for the sampling loop
+    sleep, clock, distance_between = time.sleep, time.time, fast_distance_m
+    hypot = math.hypot
+    append_sample, encode_sample = samples.append, _encode_telemetry_sample
+    deg_per_rad = 180.0 / math.pi
     
     while telemetry_active:
         try:
-            if vehicle and vehicle.armed:
-                location = vehicle.location.global_relative_frame
-                attitude = vehicle.attitude
-                heading = math.degrees(attitude.yaw) if attitude.yaw else 0
-                if heading < 0: 
-                    heading += 360
+            ts = clock()
+            # Snapshot shared state once per tick; other threads may rebind it
+            veh, mission = vehicle, current_mission
+            mission_active = is_mission_active and mission is not None
+            if veh is None:
+                # Nothing to sample until a mission connects the vehicle
+                vehicle_connected.wait()
+                continue
+            armed = veh.armed
+            if armed:
+                location = veh.location.global_relative_frame
+                lat, lon, alt = location.lat, location.lon, location.alt
+                attitude = veh.attitude
+                # Round before wrapping so %.2f can never print 360.00
+                heading = (round((attitude.yaw or 0.0) * deg_per_rad, 2) + 360.0) % 360.0
                     
-                velocity = vehicle.velocity
-                ground_speed = math.sqrt(velocity[0]**2 + velocity[1]**2) if velocity[0] else 0
+                velocity = veh.velocity
+                ground_speed = hypot(velocity[0] or 0.0, velocity[1] or 0.0)
                 
                 # Calculate distance flown
-                if previous_position and is_mission_active:
-                    distance = calculate_distance(
-                        previous_position.lat, previous_position.lon,
-                        location.lat, location.lon
+                if prev_lat is not None and mission_active and mission.m_per_deg_lon:
+                    mission.distance_flown += distance_between(
+                        prev_lat, prev_lon, lat, lon, mission.m_per_deg_lon
                     )
-                    if current_mission:
-                        current_mission.distance_flown += distance
-                previous_position = location
+                prev_lat, prev_lon = lat, lon
                 
-                telemetry_data = {
-                    "lat": location.lat, "lng": location.lon, "alt": location.alt,
-                    "alt_feet": location.alt / 0.3048, "heading": heading,
-                    "ground_speed": ground_speed,
-                    "battery": vehicle.battery.level if vehicle.battery.level else 100,
-                    "mode": str(vehicle.mode.name), "armed": vehicle.armed,
-                    "gps_fix": vehicle.gps_0.fix_type if vehicle.gps_0 else 0
-                }
-                
-                if is_mission_active and current_mission:
-                    telemetry_data["mission_status"] = {
-                        "active": True, 
-                        "photos_taken": current_mission.photos_taken, 
-                        "current_waypoint": current_mission.current_waypoint,
-                        "distance_flown": current_mission.distance_flown
-                    }
-                    
-                send_message("telemetry", telemetry_data)
-            time.sleep(0.1)
+                battery_level, gps = veh.battery.level, veh.gps_0
+                append_sample(encode_sample(
+                    lat, lon, alt, heading, ground_speed,
+                    battery_level if battery_level else 100, veh.mode.name,
+                    gps.fix_type if gps else 0,
+                    mission if mission_active else None
+                ))
+                if len(samples) == TELEMETRY_BATCH_SIZE:
+                    send_telemetry_batch(samples, ts)
+                    samples.clear()
+            elif samples:
+                # Flush the partial batch once the vehicle disarms
+                send_telemetry_batch(samples, ts)
+                samples.clear()
+            sleep(TELEMETRY_SAMPLE_INTERVAL)
         except Exception as e:
             send_message("error", f"Telemetry thread error: {e}")
-            time.sleep(1)
+            sleep(1)
     telemetry_active = False
 
 # --- NEW: Function to handle commands from stdin in a thread ---
 def handle_client_messages():
     """Handle incoming messages from stdin."""
-    global is_mission_active, mission_task, sitl_process
+    global is_mission_active, mission_task
     
     for line in sys.stdin:
         try:
-            data = json.loads(line)
+            data = _loads(line)
             command = data.get("command")
             
             if command == "start_mission":
-                if is_mission_active:
+                if is_mission_active or (mission_task and mission_task.is_alive()):
                     send_message("error", "Mission already in progress")
                     continue
-                    
-                # Start SITL if not already running
-                if not vehicle:
-                    sitl_process = start_sitl()
-                    if not sitl_process:
-                        send_message("error", "Failed to start SITL simulator")
-                        continue
-                    
-                    # Connect to drone
-                    if not connect_to_drone():
-                        send_message("error", "Failed to connect to drone")
-                        continue
                 
                 mission_data = data.get("data", {})
-                mission_task = threading.Thread(target=execute_mission, args=(mission_data,))
+                mission_cancel_requested.clear()
+                mission_task = threading.Thread(target=run_mission, args=(mission_data,))
                 mission_task.start()
                 
             elif command == "stop_mission":
                 if is_mission_active:
+                    mission_cancel_requested.set()
                     is_mission_active = False
-                    send_message("status", "Stopping mission...")
+                    send_prebuilt(STATUS_STOPPING)
                     if vehicle: 
-                        vehicle.mode = VehicleMode("RTL")
+                        vehicle.mode = MODE_RTL
+                elif mission_task and mission_task.is_alive():
+                    # Still starting up; run_mission/execute_mission check the event
+                    mission_cancel_requested.set()
+                    send_prebuilt(STATUS_STOPPING)
                 else:
                     send_message("warning", "No active mission to stop")
                     
             elif command == "emergency_land":
                 if vehicle and vehicle.armed:
-                    vehicle.mode = VehicleMode("LAND")
-                    send_message("status", "Emergency landing initiated")
+                    vehicle.mode = MODE_LAND
+                    send_prebuilt(STATUS_EMERGENCY_LAND)
                     
             elif command == "get_status":
                 status = {
@@ -479,11 +794,12 @@ def handle_client_messages():
                 send_message("vehicle_status", status)
                 
             elif command == "shutdown":
-                send_message("status", "Shutting down simulation...")
+                send_prebuilt(STATUS_SHUTTING_DOWN)
                 if vehicle:
                     vehicle.close()
                 if sitl_process:
                     sitl_process.stop()
+                flush_messages()
                 os._exit(0)
                 
         except json.JSONDecodeError:
@@ -493,7 +809,10 @@ def handle_client_messages():
 
 # --- NEW: Main execution block for synchronous script ---
 if __name__ == "__main__":
-    send_message("status", "Python simulation server started")
+    # Start the stdout writer before anything else can queue messages
+    writer_thread = threading.Thread(target=_write_messages, daemon=True)
+    writer_thread.start()
+    send_prebuilt(STATUS_SERVER_STARTED)
     
     # Start telemetry in a background thread
     telemetry_thread = threading.Thread(target=stream_telemetry, daemon=True)
@@ -503,10 +822,11 @@ if __name__ == "__main__":
     try:
         handle_client_messages()
     except KeyboardInterrupt:
-        send_message("status", "Shutdown signal received.")
+        send_prebuilt(STATUS_SHUTDOWN_SIGNAL)
     finally:
         if vehicle:
-            send_message("status", "Closing vehicle connection.")
+            send_prebuilt(STATUS_CLOSING_VEHICLE)
             vehicle.close()
         if sitl_process:
-            sitl_process.stop()
\ No newline at end of file
+            sitl_process.stop()
+        flush_messages()
\ No newline at end of file
@@ -191,8 +191,10 @@ const InteractiveMap = forwardRef(({
         console.log('Server connection confirmed:', data.payload);
         break;
 
-      case 'telemetry':
-        const telemetryData = data.payload;
+      case 'telemetry_batch': {
+        const samples = data.payload;
+        if (!samples || samples.length === 0) break;
+        const telemetryData = samples[samples.length - 1];
         
         // Smooth transition for drone movement
         setDronePosition(prev => {
@@ -209,10 +211,14 @@ const InteractiveMap = forwardRef(({
           prev.status ? { ...prev, altitude: telemetryData.alt || 0 } : prev
         );
 
-        if (telemetryData.lat && telemetryData.lng) {
+        const pathPoints = samples
+          .filter(sample => sample.lat && sample.lng)
+          .map(sample => [sample.lat, sample.lng]);
+        if (pathPoints.length > 0) {
           setFlightPath(prev => {
-            const newPath = [...prev, [telemetryData.lat, telemetryData.lng]];
-            return newPath.slice(-500);
+            const newPath = [...prev, ...pathPoints];
+            // Telemetry is sampled at 20 Hz, so 1000 points keep ~50 s of trail
+            return newPath.slice(-1000);
           });
         }
         
@@ -230,6 +236,7 @@ const InteractiveMap = forwardRef(({
           batteryLevel: telemetryData.battery || 100 
         }));
         break;
+      }
 
       case 'status':
         toast.info(data.payload);
@@ -247,22 +254,21 @@ const InteractiveMap = forwardRef(({
         toast.info(`Mission started: ${missionInfo.total_waypoints} waypoints, estimated ${missionInfo.estimated_time}s`);
         break;
 
-      case 'waypoint_progress':
-        const progress = data.payload;
-        setMissionStatus(prev => ({ ...prev, currentWaypoint: progress.current, totalWaypoints: progress.total, progress: progress.percentage }));
-        break;
-
-      case 'photo_taken':
-        const photoData = data.payload;
-        setPhotoLocations(prev => [...prev, { 
-          id: photoData.photo_number, 
-          lat: photoData.location.lat, 
-          lng: photoData.location.lng, 
-          altitude: photoData.location.altitude, 
-          timestamp: new Date() 
-        }]);
-        setSimulationStats(prev => ({ ...prev, photosToTaken: photoData.photo_number }));
+      case 'waypoint_complete': {
+        const waypoint = data.payload;
+        setMissionStatus(prev => ({ ...prev, currentWaypoint: waypoint.current, totalWaypoints: waypoint.total, progress: waypoint.percentage }));
+        if (waypoint.photo_taken) {
+          setPhotoLocations(prev => [...prev, { 
+            id: waypoint.photo_number, 
+            lat: waypoint.location.lat, 
+            lng: waypoint.location.lng, 
+            altitude: waypoint.location.altitude, 
+            timestamp: new Date() 
+          }]);
+          setSimulationStats(prev => ({ ...prev, photosToTaken: waypoint.photo_number }));
+        }
         break;
+      }
 
       case 'mission_complete':
         const completionData = data.payload;